@@ -1,5 +1,6 @@
 import pandas as pd 
 import json
+import os
 from collections import Counter
 
 df = pd.read_csv("metrics.csv")
@@ -116,3 +117,46 @@ with open("metrics_summary.html", "w", encoding="utf-8") as f:
     f.write(html)
 
 print("Generados: metrics_summary.csv y metrics_summary.html (con MS1, MS2, MS3 en columnas)")  
+
+# --- Desglose por etapas (ruta crítica) a partir de traces.csv ---
+if os.path.exists("traces.csv"):
+    traces = pd.read_csv("traces.csv")
+
+    ruta_critica = []
+    for request_id, group in traces.groupby("request_id"):
+        recibidas = group.dropna(subset=["receive_s"])
+        if recibidas.empty:
+            continue
+
+        consenso_s = group["consensus_s"].iloc[0]
+        marcadas = recibidas[recibidas["critical"] == 1]
+        if not marcadas.empty:
+            # La respuesta crítica es la que completó la mayoría (marcada por el validador)
+            critica = marcadas.iloc[0]
+        else:
+            # Sin consenso: la ruta crítica termina en la última respuesta recibida
+            critica = recibidas.loc[recibidas["receive_s"].idxmax()]
+        fin_s = consenso_s if pd.notna(consenso_s) else critica["receive_s"]
+
+        otros_inventario = critica["service_s"] - critica["processing_s"] - critica["db_s"]
+
+        ruta_critica.append({
+            "id_peticion": request_id,
+            "estado": critica["status"],
+            "microservicio_critico": alias_map.get(critica["microservice_id"], str(critica["microservice_id"])),
+            "publicacion": critica["publish_s"],
+            "cola_broker": critica["broker_queue_s"],
+            "procesamiento": critica["processing_s"],
+            "db": critica["db_s"],
+            "otros_inventario": otros_inventario,
+            "transito_respuesta": critica["reply_transit_s"],
+            "votacion": fin_s - critica["receive_s"],
+            "total": fin_s,
+        })
+
+    ruta_df = pd.DataFrame(ruta_critica)
+    ruta_df.to_csv("traces_summary.csv", index=False)
+    with open("traces_summary.html", "w", encoding="utf-8") as f:
+        f.write(ruta_df.to_html(index=False, float_format=lambda v: f"{v:.4f}"))
+
+    print("Generados: traces_summary.csv y traces_summary.html (ruta crítica por etapas)")
@@ -8,6 +8,7 @@ import random
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, Product
+from log_config import setup_logging, sample_message_logs
 
 # Conexión a SQLite (archivo dentro del contenedor)
 DATABASE_URL = os.getenv("DB_URL", "sqlite:///./inventario.db")
@@ -23,6 +24,9 @@ app = Flask(__name__)
 # Obtener número de instancia
 instance_number = os.getenv("INSTANCE_NUMBER", "1")
 
+# Logger con niveles; la escritura a stdout ocurre en un hilo aparte
+logger, log_listener = setup_logging(instance_number)
+
 # Leer configuración para override_quantity
 import pathlib
 
@@ -32,7 +36,7 @@ try:
         config = json.load(f)
     override_quantity = config.get("override_quantity", False)
 except Exception as e:
-    print(f"[INVENTARIO {instance_number}] [CONFIG] Error loading config: {e}")
+    logger.warning("[CONFIG] Error loading config: %s", e)
     override_quantity = False
 
 
@@ -48,11 +52,14 @@ def get_rabbitmq_connection():
                     host="rabbitmq", connection_attempts=5, retry_delay=3
                 )
             )
-            print(f"Microservice {instance_number} connected to RabbitMQ")
+            logger.debug("Connected to RabbitMQ")
             return connection
         except Exception as e:
-            print(
-                f"Microservice {instance_number} failed to connect to RabbitMQ (attempt {attempt+1}/{max_retries}): {e}"
+            logger.warning(
+                "Failed to connect to RabbitMQ (attempt %d/%d): %s",
+                attempt + 1,
+                max_retries,
+                e,
             )
             if attempt < max_retries - 1:
                 time.sleep(retry_delay)
@@ -60,105 +67,119 @@ def get_rabbitmq_connection():
                 raise
 
 
-def process_requests():
-    """Procesar solicitudes de RabbitMQ"""
-
-    def callback(ch, method, properties, body):
-        try:
-            print(f"[INVENTARIO {instance_number}] [RECEIVED] Raw message: {body}")
-            print(
-                f"[INVENTARIO {instance_number}] [PROPERTIES] Content-Type: {getattr(properties, 'content_type', None)} Headers: {getattr(properties, 'headers', None)}"
-            )
-            data = json.loads(body)
-            request_id = data.get("request_id")
-            request_data = data.get("data")
-            response_routing_key = data.get("response_routing_key")
-            print(
-                f"[INVENTARIO {instance_number}] [PROCESSING] Request ID: {request_id}, Data: {request_data}, Routing Key: {response_routing_key}"
+def callback(ch, method, properties, body):
+    """Procesar una solicitud de inventario recibida de RabbitMQ"""
+    # Primero los instantes de desencolado, para no contar trabajo del callback como cola
+    # Enteros en nanosegundos: pika 1.3.2 no codifica floats en cabeceras AMQP
+    dequeue_ns = time.time_ns()
+    dequeue_mono_ns = time.perf_counter_ns()
+    try:
+        # Los volcados de payload solo se formatean si DEBUG está activo
+        log_info = sample_message_logs(logger)
+        logger.debug("[RECEIVED] Raw message: %s", body)
+        logger.debug(
+            "[PROPERTIES] Content-Type: %s Headers: %s",
+            getattr(properties, "content_type", None),
+            getattr(properties, "headers", None),
+        )
+        # Contexto de traza propagado por el validador en las cabeceras AMQP
+        trace = dict(getattr(properties, "headers", None) or {})
+        trace["x-dequeue-ns"] = dequeue_ns
+        data = json.loads(body)
+        request_id = data.get("request_id")
+        request_data = data.get("data")
+        response_routing_key = data.get("response_routing_key")
+        if log_info:
+            logger.info(
+                "[PROCESSING] request_id=%s routing_key=%s",
+                request_id,
+                response_routing_key,
             )
-            # Simular procesamiento
-            processing_time = 1  # 1 segundo de procesamiento simulado
-            time.sleep(processing_time)
-            # Leer config en cada ciclo para asegurar que cada instancia la lea correctamente
-            import pathlib
-
-            config_path = pathlib.Path(__file__).parent / "inventario_config.json"
-            try:
-                with open(config_path, "r") as f:
-                    config = json.load(f)
-                override_quantity = config.get("override_quantity", False)
-            except Exception as e:
-                print(
-                    f"[INVENTARIO {instance_number}] [CONFIG] Error loading config: {e}"
-                )
-                override_quantity = False
+        logger.debug("[PROCESSING] request_id=%s data=%s", request_id, request_data)
+        # Simular procesamiento
+        processing_time = 1  # 1 segundo de procesamiento simulado
+        processing_start_ns = time.perf_counter_ns()
+        time.sleep(processing_time)
+        trace["x-processing-ns"] = time.perf_counter_ns() - processing_start_ns
+        # Leer config en cada ciclo para asegurar que cada instancia la lea correctamente
+        import pathlib
+
+        config_path = pathlib.Path(__file__).parent / "inventario_config.json"
+        try:
+            with open(config_path, "r") as f:
+                config = json.load(f)
+            override_quantity = config.get("override_quantity", False)
+        except Exception as e:
+            logger.warning("[CONFIG] Error loading config: %s", e)
+            override_quantity = False
 
-            # quantity = 100
-            # Abrir sesión de DB
-            db = SessionLocal()
+        # quantity = 100
+        # Abrir sesión de DB
+        db = SessionLocal()
 
-            product_id = request_data.get("product_id", "unknown")
-            product = db.query(Product).filter_by(product_id=product_id).first()
+        product_id = request_data.get("product_id", "unknown")
+        db_start_ns = time.perf_counter_ns()
+        product = db.query(Product).filter_by(product_id=product_id).first()
+        trace["x-db-ns"] = time.perf_counter_ns() - db_start_ns
 
-            if product:
-                # Producto encontrado en BD
-                quantity = product.quantity
-                in_stock = product.in_stock
-            else:
-                # Si no existe, puedes decidir retornarlo con stock=0
-                quantity = 0
-                in_stock = False
-
-                db.close()
-
-            # Determinar override_quantity por probabilidad (70% false, 30% true)
-            override_quantity = random.random() < 0.3     
-
-            try:
-                inst_num = int(instance_number)
-            except Exception:
-                inst_num = instance_number
-            if override_quantity and inst_num == 2:
-                quantity = 500
-            elif override_quantity and inst_num == 3:
-                quantity = 300
-
-            print(
-                f"[INVENTARIO {instance_number}] [OVERRIDE] {override_quantity}"
-            )
+        if product:
+            # Producto encontrado en BD
+            quantity = product.quantity
+            in_stock = product.in_stock
+        else:
+            # Si no existe, puedes decidir retornarlo con stock=0
+            quantity = 0
+            in_stock = False
 
-            response = {
-                "microservice_id": int(instance_number),
-                "request_id": request_id,
-                "status": "processed",
-                "processing_time": processing_time,
-                "data": {
-                    "product_id": product_id,
-                    "in_stock": in_stock,
-                    "quantity": quantity,
-                    "instance": instance_number,
-                    "timestamp": time.time(),
-                },
-            }
-            print(
-                f"[INVENTARIO {instance_number}] [RESPONSE] Ready to send: {response}"
-            )
-            # Enviar respuesta
-            send_response(response_routing_key, response)
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            print(
-                f"[INVENTARIO {instance_number}] [COMPLETE] Request {request_id} processed and acknowledged."
-            )
-        except json.JSONDecodeError as e:
-            print(
-                f"[INVENTARIO {instance_number}] [ERROR] JSON decode error: {e} | Body: {body}"
-            )
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        except Exception as e:
-            print(
-                f"[INVENTARIO {instance_number}] [ERROR] Exception processing request: {e}"
+            db.close()
+
+        # Determinar override_quantity por probabilidad (70% false, 30% true)
+        override_quantity = random.random() < 0.3     
+
+        try:
+            inst_num = int(instance_number)
+        except Exception:
+            inst_num = instance_number
+        if override_quantity and inst_num == 2:
+            quantity = 500
+        elif override_quantity and inst_num == 3:
+            quantity = 300
+
+        response = {
+            "microservice_id": int(instance_number),
+            "request_id": request_id,
+            "status": "processed",
+            "processing_time": processing_time,
+            "data": {
+                "product_id": product_id,
+                "in_stock": in_stock,
+                "quantity": quantity,
+                "instance": instance_number,
+                "timestamp": time.time(),
+            },
+        }
+        logger.debug("[OVERRIDE] %s", override_quantity)
+        # response es un dict (mutable): DeferredQueueHandler lo formatea en este hilo
+        logger.debug("[RESPONSE] Ready to send: %s", response)
+        # Enviar respuesta
+        send_response(response_routing_key, response, trace, dequeue_mono_ns)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        if log_info:
+            logger.info(
+                "[COMPLETE] request_id=%s override=%s processed and acknowledged",
+                request_id,
+                override_quantity,
             )
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+    except json.JSONDecodeError as e:
+        logger.error("JSON decode error: %s | Body: %s", e, body)
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+    except Exception as e:
+        logger.error("Exception processing request: %s", e)
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+
+def process_requests():
+    """Procesar solicitudes de RabbitMQ"""
 
     # Reconexión en caso de fallo
     while True:
@@ -183,19 +204,16 @@ def process_requests():
             channel.basic_qos(prefetch_count=1)
             channel.basic_consume(queue=queue_name, on_message_callback=callback)
 
-            print(f"Microservice {instance_number} waiting for requests...")
+            logger.info("Waiting for requests...")
             channel.start_consuming()
         except Exception as e:
-            print(f"RabbitMQ connection failed: {e}. Retrying in 5 seconds...")
+            logger.error("RabbitMQ connection failed: %s. Retrying in 5 seconds...", e)
             time.sleep(5)
 
 
-def send_response(routing_key, response_data):
-    """Enviar respuesta a través de RabbitMQ"""
+def send_response(routing_key, response_data, trace=None, dequeue_mono_ns=None):
+    """Enviar respuesta a través de RabbitMQ, devolviendo el contexto de traza en las cabeceras"""
     try:
-        print(
-            f"[INVENTARIO {instance_number}] [SEND_RESPONSE] Connecting to RabbitMQ to send response..."
-        )
         connection = get_rabbitmq_connection()
         channel = connection.channel()
         # Declarar exchange para respuestas (asegurarse de que existe)
@@ -208,23 +226,30 @@ def send_response(routing_key, response_data):
             "microservice_id": response_data["microservice_id"],
             "response": response_data,  # Enviar todo el objeto de respuesta
         }
-        print(
-            f"[INVENTARIO {instance_number}] [SEND_RESPONSE] Publishing to exchange 'responses' with routing_key '{routing_key}': {message}"
+        # message es un dict (mutable): DeferredQueueHandler lo formatea en este hilo
+        logger.debug(
+            "[SEND_RESPONSE] Publishing to exchange 'responses' with routing_key '%s': %s",
+            routing_key,
+            message,
         )
+        headers = dict(trace or {})
+        if dequeue_mono_ns is not None:
+            # Tiempo total dentro de este servicio, medido con reloj monotónico
+            headers["x-service-ns"] = time.perf_counter_ns() - dequeue_mono_ns
         channel.basic_publish(
             exchange="responses",
             routing_key=routing_key,
             body=json.dumps(message),
             properties=pika.BasicProperties(
-                delivery_mode=2, content_type="application/json"  # Mensaje persistente
+                delivery_mode=2,  # Mensaje persistente
+                content_type="application/json",
+                headers=headers,
             ),
         )
-        print(
-            f"[INVENTARIO {instance_number}] [SEND_RESPONSE] Response sent and connection closed."
-        )
+        logger.debug("[SEND_RESPONSE] Response sent and connection closed.")
         connection.close()
     except Exception as e:
-        print(f"[INVENTARIO {instance_number}] [ERROR] Error sending response: {e}")
+        logger.error("Error sending response: %s", e)
 
 
 if __name__ == "__main__":
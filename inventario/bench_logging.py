@@ -0,0 +1,194 @@
+"""Benchmark del costo de logging por mensaje en el hilo del callback de inventario.
+
+Ejecuta el callback real de app.py con el canal, la conexión a RabbitMQ y la
+sesión de DB reemplazados por stubs y sin la espera de procesamiento simulado.
+Compara los print originales (volcados de payload con f-strings) contra el logger
+en cola con distintos niveles y tasas de muestreo. Cada caso se mide con dos
+destinos: un archivo temporal (rápido) y un destino lento que bloquea en cada
+write, como un pipe de logs de contenedor saturado. Con el logger en cola la
+escritura ocurre en otro hilo.
+
+Uso (desde inventario/): python bench_logging.py [num_mensajes]
+"""
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# Base de datos en memoria para no crear inventario.db al importar app
+os.environ.setdefault("DB_URL", "sqlite://")
+
+import log_config
+import app
+from log_config import setup_logging
+
+# Tiempo de bloqueo por write del destino lento
+SLOW_WRITE_DELAY = 0.0002
+
+# main() anula time.sleep para saltar el procesamiento simulado del callback
+real_sleep = time.sleep
+
+body = json.dumps(
+    {
+        "request_id": "validador1-1-42",
+        "data": {"product_id": "12345", "action": "check_inventory"},
+        "response_routing_key": "validador.validador1.1",
+    }
+).encode()
+
+
+class Properties:
+    content_type = "application/json"
+    headers = {"x-trace-id": "validador1-1-42", "x-publish-ns": time.time_ns()}
+
+
+class Method:
+    delivery_tag = 1
+
+
+class StubChannel:
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        pass
+
+    def basic_ack(self, delivery_tag):
+        pass
+
+    def basic_nack(self, delivery_tag, requeue):
+        raise RuntimeError("el callback falló durante el benchmark")
+
+
+class StubConnection:
+    def channel(self):
+        return StubChannel()
+
+    def close(self):
+        pass
+
+
+class StubQuery:
+    def filter_by(self, **kwargs):
+        return self
+
+    def first(self):
+        return None
+
+
+class StubSession:
+    def query(self, model):
+        return StubQuery()
+
+    def close(self):
+        pass
+
+
+class SlowSink:
+    """Destino que bloquea en cada write, como stdout hacia un pipe lento"""
+
+    def write(self, text):
+        real_sleep(SLOW_WRITE_DELAY)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def print_original(properties):
+    """Los print que hacía el callback (y send_response) por cada mensaje antes del logger"""
+    instance_number = app.instance_number
+    data = json.loads(body)
+    response = {
+        "microservice_id": int(instance_number),
+        "request_id": data["request_id"],
+        "status": "processed",
+        "processing_time": 1,
+        "data": {
+            "product_id": data["data"]["product_id"],
+            "in_stock": False,
+            "quantity": 0,
+            "instance": instance_number,
+            "timestamp": time.time(),
+        },
+    }
+    message = {"request_id": data["request_id"], "microservice_id": 1, "response": response}
+    print(f"[INVENTARIO {instance_number}] [RECEIVED] Raw message: {body}")
+    print(
+        f"[INVENTARIO {instance_number}] [PROPERTIES] Content-Type: {getattr(properties, 'content_type', None)} Headers: {getattr(properties, 'headers', None)}"
+    )
+    print(
+        f"[INVENTARIO {instance_number}] [PROCESSING] Request ID: {data['request_id']}, Data: {data['data']}, Routing Key: {data['response_routing_key']}"
+    )
+    print(f"[INVENTARIO {instance_number}] [OVERRIDE] {False}")
+    print(f"[INVENTARIO {instance_number}] [RESPONSE] Ready to send: {response}")
+    print(f"[INVENTARIO {instance_number}] [SEND_RESPONSE] Connecting to RabbitMQ to send response...")
+    print(
+        f"[INVENTARIO {instance_number}] [SEND_RESPONSE] Publishing to exchange 'responses' with routing_key '{data['response_routing_key']}': {message}"
+    )
+    print(f"[INVENTARIO {instance_number}] [SEND_RESPONSE] Response sent and connection closed.")
+    print(f"[INVENTARIO {instance_number}] [COMPLETE] Request {data['request_id']} processed and acknowledged.")
+
+
+def bench(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def run_cases(sink, n, properties):
+    channel = StubChannel()
+    method = Method()
+
+    def run_callback():
+        app.callback(channel, method, properties, body)
+
+    def run_callback_with_prints():
+        run_callback()
+        print_original(properties)
+
+    results = []
+    for label, fn, level, sample_rate in [
+        # El caso original: callback sin logs del logger más los print de antes
+        ("print (original)", run_callback_with_prints, logging.WARNING, 1.0),
+        ("logging off (WARNING)", run_callback, logging.WARNING, 1.0),
+        ("INFO, muestreo 1.0", run_callback, logging.INFO, 1.0),
+        ("INFO, muestreo 0.1", run_callback, logging.INFO, 0.1),
+        ("DEBUG", run_callback, logging.DEBUG, 1.0),
+    ]:
+        log_config.LOG_SAMPLE_RATE = sample_rate
+        _, listener = setup_logging(app.instance_number, stream=sink, level=level)
+        with contextlib.redirect_stdout(sink):
+            results.append((label, bench(fn, n)))
+        listener.stop()
+    return results
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    properties = Properties()
+
+    # El logger de app escribe ahora en el destino de cada caso
+    app.log_listener.stop()
+    app.get_rabbitmq_connection = StubConnection
+    app.SessionLocal = StubSession
+    time.sleep = lambda seconds: None
+
+    with tempfile.TemporaryFile("w") as sink:
+        fast = run_cases(sink, n, properties)
+    # El destino lento tarda ~n * writes * SLOW_WRITE_DELAY; se usan menos mensajes
+    slow_n = max(1, n // 20)
+    slow = run_cases(SlowSink(), slow_n, properties)
+
+    print("Costo del callback por mensaje (us/mensaje):")
+    print(f"  {'':<24} {'archivo (' + str(n) + ')':>16} {'lento (' + str(slow_n) + ')':>16}")
+    for (label, fast_us), (_, slow_us) in zip(fast, slow):
+        print(f"  {label:<24} {fast_us:16.2f} {slow_us:16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+# Nivel de log (DEBUG, INFO, WARNING, ...) y fracción de mensajes con log INFO por mensaje
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+
+# Tipos de argumento que no pueden cambiar entre el log y su formateo diferido
+IMMUTABLE_ARG_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que, cuando es seguro, no formatea en el hilo que emite el log.
+
+    El QueueHandler estándar formatea el mensaje en prepare(). Aquí, si todos los
+    argumentos son inmutables, se encola el record tal cual y el formateo ocurre
+    en el hilo del QueueListener. Con argumentos mutables (dicts como la respuesta
+    o el mensaje) se formatea en el momento, para no registrar un valor mutado.
+    """
+
+    def prepare(self, record):
+        if isinstance(record.args, tuple) and all(
+            isinstance(arg, IMMUTABLE_ARG_TYPES) for arg in record.args
+        ):
+            return record
+        return super().prepare(record)
+
+
+class StoppableQueueListener(logging.handlers.QueueListener):
+    """QueueListener cuyo stop() se puede llamar más de una vez (p. ej. a mano y en atexit)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        """Vacía la cola y detiene el hilo, si sigue en marcha"""
+        if not self.running:
+            return
+        self.running = False
+        super().stop()
+
+
+def setup_logging(instance_number, stream=None, level=None):
+    """Configura el logger 'inventario' con un handler en cola que escribe fuera del hilo"""
+    logger = logging.getLogger("inventario")
+    logger.setLevel(level or LOG_LEVEL)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(
+        logging.Formatter(
+            f"%(asctime)s %(levelname)s [INVENTARIO {instance_number}] %(message)s"
+        )
+    )
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = StoppableQueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger, listener
+
+
+def sample_message_logs(logger):
+    """Decide una vez por mensaje si se emiten sus logs INFO (según LOG_SAMPLE_RATE)"""
+    if not logger.isEnabledFor(logging.INFO):
+        return False
+    return LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+
@@ -0,0 +1,106 @@
+"""Las propiedades AMQP reales de solicitud y respuesta deben poder codificarse con pika.
+
+pika 1.3.2 no codifica floats en cabeceras; si alguna cabecera de traza lo fuera,
+basic_publish fallaría en cada request.
+"""
+import csv
+import importlib.util
+import json
+import pathlib
+import sys
+import time
+
+import pytest
+
+pika = pytest.importorskip("pika")
+pytest.importorskip("flask")
+pytest.importorskip("sqlalchemy")
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def load_app(name, directory):
+    sys.path.insert(0, str(directory))
+    spec = importlib.util.spec_from_file_location(name, directory / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeChannel:
+    def __init__(self):
+        self.published = []
+        self.acked = []
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        # pika codifica las propiedades al publicar; aquí se hace lo mismo
+        properties.encode()
+        self.published.append((routing_key, body, properties))
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue):
+        raise AssertionError("message was nacked")
+
+
+class FakeConnection:
+    def __init__(self, channel):
+        self._channel = channel
+
+    def channel(self):
+        return self._channel
+
+    def close(self):
+        pass
+
+
+class FakeMethod:
+    delivery_tag = 1
+
+
+def roundtrip(properties):
+    """Propiedades tal como las entrega pika al consumidor"""
+    decoded = pika.BasicProperties()
+    decoded.decode(b"".join(properties.encode()))
+    return decoded
+
+
+def test_request_and_reply_headers_encode(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DB_URL", f"sqlite:///{tmp_path / 'inventario.db'}")
+    validador = load_app("validador_app", ROOT / "validador")
+    inventario = load_app("inventario_app", ROOT / "inventario")
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+
+    # Solicitud publicada por el validador
+    request_channel = FakeChannel()
+    monkeypatch.setattr(validador, "get_rabbitmq_connection", lambda: FakeConnection(request_channel))
+    validador.request_traces["r1"] = {"start": time.perf_counter(), "publish": {}, "replies": {}}
+    validador.send_to_rabbitmq("r1", [1], {"product_id": "12345"})
+    _, request_body, request_properties = request_channel.published[0]
+
+    # Respuesta publicada por el inventario al procesarla
+    reply_channel = FakeChannel()
+    monkeypatch.setattr(inventario, "get_rabbitmq_connection", lambda: FakeConnection(reply_channel))
+    inventario.callback(FakeChannel(), FakeMethod(), roundtrip(request_properties), request_body)
+    assert len(reply_channel.published) == 1
+    routing_key, reply_body, reply_properties = reply_channel.published[0]
+    assert routing_key == validador.get_reply_routing_key()
+
+    # El validador exporta la traza a partir de las cabeceras recibidas
+    trace = validador.request_traces.pop("r1")
+    trace["replies"][1] = {"receive": time.perf_counter(), "headers": roundtrip(reply_properties).headers}
+    trace["critical"] = 1
+    validador.export_trace("r1", trace, "consensus_reached", time.perf_counter())
+
+    with open(validador.TRACES_FILE, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["request_id"] == "r1"
+    assert rows[0]["critical"] == "1"
+    for column in ("broker_queue_s", "processing_s", "db_s", "service_s", "reply_transit_s"):
+        assert float(rows[0][column]) >= 0
+    assert json.loads(reply_body)["request_id"] == "r1"
@@ -6,6 +6,7 @@ import os
 import time
 import sys
 import csv
+import socket
 from collections import Counter
 
 sys.stdout.reconfigure(line_buffering=True)
@@ -15,14 +16,31 @@ app = Flask(__name__)
 responses = {}
 responses_lock = threading.Lock()
 current_request_id = 0
+request_id_lock = threading.Lock()
+
+# Identificador de esta instancia del validador (contenedor); por defecto el hostname
+VALIDADOR_ID = os.getenv("VALIDADOR_ID", socket.gethostname())
+
+# Estado del consumidor de respuestas. Se guarda el pid para volver a arrancarlo
+# en cada worker tras un fork (servidores pre-fork como gunicorn).
+consumer_pid = None
+consumer_ready = threading.Event()
+consumer_start_lock = threading.Lock()
 
 # Para medir latencias por request
 request_start_times = {}
 
 METRICS_FILE = "metrics.csv"
 
+# Trazas por etapa de cada request (una fila por microservicio consultado)
+TRACES_FILE = "traces.csv"
+
+# Contexto de traza en curso: request_id -> instantes monotónicos y cabeceras de respuesta
+request_traces = {}
+
 # Lock para escritura en CSV (evita colisiones entre hilos)
 metrics_lock = threading.Lock()
+traces_lock = threading.Lock()
 
 # Inicializar CSV con encabezados si no existe
 if not os.path.exists(METRICS_FILE):
@@ -40,6 +58,25 @@ if not os.path.exists(METRICS_FILE):
             "thread_id",
         ])
 
+if not os.path.exists(TRACES_FILE):
+    with open(TRACES_FILE, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "timestamp",
+            "request_id",
+            "microservice_id",
+            "status",
+            "publish_s",
+            "broker_queue_s",
+            "processing_s",
+            "db_s",
+            "service_s",
+            "reply_transit_s",
+            "receive_s",
+            "consensus_s",
+            "critical",
+        ])
+
 def log_metric(event, request_id=None, status="", extra_info="", microservice_id="-", failed_microservices=None):
     proc_id = os.getpid()
     thread_id = threading.get_ident()
@@ -75,6 +112,74 @@ def log_metric(event, request_id=None, status="", extra_info="", microservice_id
                 thread_id,
             ])
 
+def ns_header_to_s(headers, name):
+    value = headers.get(name)
+    return value / 1e9 if value is not None else None
+
+def export_trace(request_id, trace, status, consensus_mono=None):
+    """Escribe en TRACES_FILE el desglose por etapas de cada microservicio consultado.
+
+    publish_s, receive_s y consensus_s son offsets desde el inicio del request medidos
+    con reloj monotónico. Solo broker_queue_s compara relojes de pared entre
+    contenedores; reply_transit_s se deduce del tiempo de ida y vuelta monotónico.
+    Las cabeceras llegan en nanosegundos enteros y se escriben en segundos. critical
+    marca la respuesta que completó la mayoría.
+    """
+    start = trace["start"]
+    critical_id = trace.get("critical")
+    rows = []
+    for microservice_id, publish_mono in trace["publish"].items():
+        reply = trace["replies"].get(microservice_id)
+        row = {
+            "publish_s": publish_mono - start,
+            "broker_queue_s": "",
+            "processing_s": "",
+            "db_s": "",
+            "service_s": "",
+            "reply_transit_s": "",
+            "receive_s": "",
+        }
+        if reply is not None:
+            headers = reply["headers"]
+            service_s = ns_header_to_s(headers, "x-service-ns")
+            broker_queue_s = None
+            if headers.get("x-publish-ns") is not None and headers.get("x-dequeue-ns") is not None:
+                broker_queue_s = max(0.0, (headers["x-dequeue-ns"] - headers["x-publish-ns"]) / 1e9)
+            processing_s = ns_header_to_s(headers, "x-processing-ns")
+            db_s = ns_header_to_s(headers, "x-db-ns")
+            row.update({
+                "processing_s": processing_s if processing_s is not None else "",
+                "db_s": db_s if db_s is not None else "",
+                "receive_s": reply["receive"] - start,
+            })
+            if broker_queue_s is not None:
+                row["broker_queue_s"] = broker_queue_s
+            if service_s is not None:
+                row["service_s"] = service_s
+                if broker_queue_s is not None:
+                    round_trip = reply["receive"] - publish_mono
+                    row["reply_transit_s"] = max(0.0, round_trip - service_s - broker_queue_s)
+        rows.append([
+            time.time(),
+            request_id,
+            microservice_id,
+            status,
+            row["publish_s"],
+            row["broker_queue_s"],
+            row["processing_s"],
+            row["db_s"],
+            row["service_s"],
+            row["reply_transit_s"],
+            row["receive_s"],
+            consensus_mono - start if consensus_mono is not None else "",
+            1 if microservice_id == critical_id else 0,
+        ])
+
+    with traces_lock:
+        with open(TRACES_FILE, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerows(rows)
+
 def get_rabbitmq_connection():
     max_retries = 5
     retry_delay = 3
@@ -100,9 +205,14 @@ def get_rabbitmq_connection():
             else:
                 raise
 
+def get_reply_routing_key():
+    """Routing key (y nombre de cola) exclusiva de este proceso para recibir respuestas"""
+    return f"validador.{VALIDADOR_ID}.{os.getpid()}"
+
 def setup_rabbitmq_consumer():
     def callback(ch, method, properties, body):
         try:
+            receive_mono = time.perf_counter()
             data = json.loads(body)
             request_id = str(data["request_id"])
             microservice_id = data["microservice_id"]
@@ -115,6 +225,13 @@ def setup_rabbitmq_consumer():
                     {"microservice_id": microservice_id, "response": response_data}
                 )
 
+                trace = request_traces.get(request_id)
+                if trace is not None:
+                    trace["replies"][microservice_id] = {
+                        "receive": receive_mono,
+                        "headers": dict(getattr(properties, "headers", None) or {}),
+                    }
+
                 start_time = request_start_times.get(request_id)
                 latency = time.time() - start_time if start_time is not None else None
 
@@ -150,32 +267,73 @@ def setup_rabbitmq_consumer():
             ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
 
     while True:
+        connection = None
         try:
             connection = get_rabbitmq_connection()
             channel = connection.channel()
             channel.exchange_declare(exchange="responses", exchange_type="direct", durable=True)
-            channel.queue_declare(queue="validador_responses", durable=True)
-            channel.queue_bind(exchange="responses", queue="validador_responses", routing_key="validador")
-            channel.basic_consume(queue="validador_responses", on_message_callback=callback)
-            log_metric("consumer_ready", status="waiting_for_responses", microservice_id="-", failed_microservices=[])
+            # Cola exclusiva por proceso: solo recibe las respuestas de sus propias solicitudes
+            reply_key = get_reply_routing_key()
+            channel.queue_declare(queue=reply_key, exclusive=True, auto_delete=True)
+            channel.queue_bind(exchange="responses", queue=reply_key, routing_key=reply_key)
+            channel.basic_consume(queue=reply_key, on_message_callback=callback)
+            log_metric("consumer_ready", status="waiting_for_responses", extra_info=reply_key,
+                       microservice_id="-", failed_microservices=[])
+            consumer_ready.set()
             channel.start_consuming()
         except Exception as e:
+            consumer_ready.clear()
             log_metric("consumer_error", status="connection_failed", extra_info=str(e), microservice_id="-", failed_microservices=[])
+            # Cerrar la conexión fallida: mientras siga abierta es dueña de la cola exclusiva
+            # y el siguiente queue_declare fallaría con RESOURCE_LOCKED
+            if connection is not None and connection.is_open:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
             time.sleep(5)
 
-@app.route("/process", methods=["POST"])
-def process_request():
+def ensure_consumer_started():
+    """Arranca el consumidor de respuestas una vez por proceso (también en workers pre-fork)"""
+    global consumer_pid, consumer_ready
+
+    with consumer_start_lock:
+        if consumer_pid == os.getpid():
+            return
+        consumer_pid = os.getpid()
+        consumer_ready = threading.Event()
+        rabbitmq_thread = threading.Thread(target=setup_rabbitmq_consumer, daemon=True)
+        rabbitmq_thread.start()
+
+def next_request_id():
     global current_request_id
 
+    with request_id_lock:
+        current_request_id += 1
+        return f"{VALIDADOR_ID}-{os.getpid()}-{current_request_id}"
+
+@app.before_request
+def start_consumer_before_request():
+    ensure_consumer_started()
+
+@app.route("/process", methods=["POST"])
+def process_request():
+    request_id = None
     try:
         data = request.get_json()
         if not data:
             log_metric("process_request", status="failed", extra_info="No JSON data provided", microservice_id="-", failed_microservices=[])
             return jsonify({"error": "No JSON data provided"}), 400
 
-        current_request_id += 1
-        request_id = str(current_request_id)
+        # No publicar hasta que la cola de respuestas exista, o las respuestas se perderían
+        if not consumer_ready.wait(timeout=10):
+            log_metric("process_request", status="failed", extra_info="Reply queue not ready", microservice_id="-", failed_microservices=[])
+            return jsonify({"error": "Reply queue not ready"}), 503
+
+        request_id = next_request_id()
         request_start_times[request_id] = time.time()
+        with responses_lock:
+            request_traces[request_id] = {"start": time.perf_counter(), "publish": {}, "replies": {}}
         log_metric("request_start", request_id=request_id, status="received", microservice_id="-", failed_microservices=[])
 
         target_microservices = determine_target_microservices(data)
@@ -198,6 +356,7 @@ def process_request():
             return json.dumps(r, sort_keys=True)
 
         while time.time() - start_time < max_wait_time:
+            consensus_trace = None
             with responses_lock:
                 request_responses = responses.get(request_id, [])
                 normalized = [normalize_response(r) for r in request_responses]
@@ -205,26 +364,35 @@ def process_request():
                 most_common = counts.most_common(1)
 
                 if most_common and most_common[0][1] >= 2:
+                    consensus_mono = time.perf_counter()
                     idx = normalized.index(most_common[0][0])
                     valid_response = request_responses[idx]
 
                     if request_id in responses:
                         del responses[request_id]
+                    consensus_trace = request_traces.pop(request_id)
+                    # La respuesta que completó la mayoría es la segunda coincidente en llegar
+                    matching = [r for r, n in zip(request_responses, normalized) if n == most_common[0][0]]
+                    consensus_trace["critical"] = matching[1]["microservice_id"]
 
                     final_wait_time = time.time() - start_time
 
-                    log_metric("vote_result", request_id=request_id, status="consensus_reached",
-                               extra_info=valid_response["response"], microservice_id="-", failed_microservices=[])
+                elif len(request_responses) >= len(target_microservices):
+                    break
+
+            if consensus_trace is not None:
+                # Exportar fuera del lock para no frenar al consumidor de respuestas
+                export_trace(request_id, consensus_trace, "consensus_reached", consensus_mono)
 
-                    log_metric("latency_summary", request_id=request_id, status="success",
-                               extra_info=f"responses={len(request_responses)}, total_time={final_wait_time:.2f}s",
-                               microservice_id="-", failed_microservices=[])
+                log_metric("vote_result", request_id=request_id, status="consensus_reached",
+                           extra_info=valid_response["response"], microservice_id="-", failed_microservices=[])
 
-                    return jsonify({"request_id": request_id, "response": valid_response["response"],
-                                    "wait_time": f"{final_wait_time:.2f}s"})
+                log_metric("latency_summary", request_id=request_id, status="success",
+                           extra_info=f"responses={len(request_responses)}, total_time={final_wait_time:.2f}s",
+                           microservice_id="-", failed_microservices=[])
 
-                if len(request_responses) >= len(target_microservices):
-                    break
+                return jsonify({"request_id": request_id, "response": valid_response["response"],
+                                "wait_time": f"{final_wait_time:.2f}s"})
 
             time.sleep(wait_interval)
 
@@ -232,6 +400,8 @@ def process_request():
             request_responses = responses.get(request_id, [])
             if request_id in responses:
                 del responses[request_id]
+            trace = request_traces.pop(request_id)
+        export_trace(request_id, trace, "no_consensus")
 
         final_wait_time = time.time() - start_time
         all_microservices = set(target_microservices)
@@ -254,6 +424,8 @@ def process_request():
         }), 500
 
     except Exception as e:
+        with responses_lock:
+            request_traces.pop(request_id, None)
         log_metric("process_request", status="error", extra_info=str(e), microservice_id="-", failed_microservices=[])
         return jsonify({"error": str(e)}), 500
 
@@ -275,19 +447,27 @@ def send_to_rabbitmq(request_id, target_microservices, data):
         connection = get_rabbitmq_connection()
         channel = connection.channel()
         channel.exchange_declare(exchange="requests", exchange_type="direct", durable=True)
+        reply_key = get_reply_routing_key()
 
         for microservice_id in target_microservices:
             send_time = time.time()
             message = {
                 "request_id": request_id,
                 "data": data,
-                "response_routing_key": "validador",
+                "response_routing_key": reply_key,
             }
+            # Contexto de traza propagado en las cabeceras AMQP (enteros: pika no codifica floats)
+            headers = {"x-trace-id": request_id, "x-publish-ns": time.time_ns()}
+            with responses_lock:
+                trace = request_traces.get(request_id)
+                if trace is not None:
+                    trace["publish"][microservice_id] = time.perf_counter()
             channel.basic_publish(
                 exchange="requests",
                 routing_key=f"microservice_{microservice_id}",
                 body=json.dumps(message),
-                properties=pika.BasicProperties(delivery_mode=2, content_type="application/json"),
+                properties=pika.BasicProperties(delivery_mode=2, content_type="application/json",
+                                                reply_to=reply_key, headers=headers),
             )
             log_metric("send_to_rabbitmq", request_id=request_id, status="sent",
                        extra_info=f"to microservice {microservice_id}, send_time={send_time}",
@@ -302,6 +482,5 @@ def send_to_rabbitmq(request_id, target_microservices, data):
         raise
 
 if __name__ == "__main__":
-    rabbitmq_thread = threading.Thread(target=setup_rabbitmq_consumer, daemon=True)
-    rabbitmq_thread.start()
+    ensure_consumer_started()
     app.run(host="0.0.0.0", port=5000, debug=False, use_reloader=False)